@@ -1,60 +1,295 @@
-from flask import Flask, jsonify
+from cachetools import TTLCache
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+from requests import Session
 from youtube_transcript_api import YouTubeTranscriptApi
 from youtube_transcript_api._errors import NoTranscriptFound, TranscriptsDisabled, VideoUnavailable
+import logging
+import orjson
 import os
+import re
+import threading
+import time
+
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+logger = logging.getLogger(__name__)
+
+class ORJSONProvider(DefaultJSONProvider):
+    # orjson не экранирует не-ASCII и по умолчанию не сортирует ключи
+    ensure_ascii = False
+    sort_keys = False
+
+    def _dump_bytes(self, obj, **kwargs):
+        # Аргументы json.dumps переводим в опции orjson; то, что
+        # orjson воспроизвести не может, - ошибка, а не тихий игнор
+        # Даты отдаем в default (HTTP-date, как у DefaultJSONProvider),
+        # не-строковые ключи приводим к строкам, как json.dumps
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if kwargs.pop('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        indent = kwargs.pop('indent', None)
+        if indent is not None:
+            if indent != 2:
+                raise TypeError('ORJSONProvider поддерживает только indent=2')
+            option |= orjson.OPT_INDENT_2
+        if kwargs.pop('ensure_ascii', False):
+            raise TypeError('ORJSONProvider не поддерживает ensure_ascii=True')
+        separators = kwargs.pop('separators', None)
+        if separators is not None and tuple(separators) != (',', ':'):
+            raise TypeError('ORJSONProvider поддерживает только separators=(",", ":")')
+        default = kwargs.pop('default', self.default)
+        if kwargs:
+            raise TypeError(f"ORJSONProvider: неподдерживаемые аргументы {', '.join(kwargs)}")
+        return orjson.dumps(obj, default=default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        return self._dump_bytes(obj, **kwargs).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            raise TypeError(f"ORJSONProvider: неподдерживаемые аргументы {', '.join(kwargs)}")
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Тело ответа сразу в bytes, без промежуточной str и .encode()
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = 2 if (self.compact is None and self._app.debug) or self.compact is False else None
+        return self._app.response_class(
+            self._dump_bytes(obj, indent=indent), mimetype=self.mimetype
+        )
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+
+# Языки субтитров в порядке приоритета
+SUBTITLE_LANGUAGES = ('ru', 'en')
+NO_TRANSCRIPT_MESSAGE = f"Субтитры на указанных языках ({', '.join(SUBTITLE_LANGUAGES)}) не найдены."
+
+# Ожидаемые ошибки библиотеки: текст ответа и HTTP-код
+_ERRORS = {
+    TranscriptsDisabled: ('Субтитры отключены для этого видео.', 400),
+    NoTranscriptFound: (NO_TRANSCRIPT_MESSAGE, 404),
+    VideoUnavailable: ('Видео недоступно (удалено или приватное).', 400),
+}
+
+# Идентификатор видео YouTube: 11 символов из [0-9A-Za-z_-]
+_VIDEO_ID_RE = re.compile(r'[0-9A-Za-z_-]{11}')
+INVALID_ID_RESULT = {'status': 'error', 'message': 'Некорректный идентификатор видео.'}
+TIMEOUT_RESULT = {'status': 'error', 'message': 'YouTube не ответил вовремя, попробуйте позже.'}
+BUSY_RESULT = {'status': 'error', 'message': 'Сервер перегружен, попробуйте позже.'}
+
+# Кэш успешных результатов по video_id: повторный запрос того же видео
+# (например, ретрай с фронтенда) не ходит в YouTube
+_RESULT_CACHE = TTLCache(maxsize=512, ttl=1800)
+_CACHE_LOCK = threading.Lock()
+
+# Общий пул потоков для обращений к YouTube: ограничивает число
+# одновременных запросов от процесса и позволяет переиспользовать future
+MAX_WORKERS = 8
+EXECUTOR = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='subtitles')
+
+# Очередь ThreadPoolExecutor не ограничена, поэтому число задач в пуле
+# (выполняемых и ожидающих) ограничиваем сами; сверх лимита - 503
+MAX_PENDING = 4 * MAX_WORKERS
+_PENDING_SLOTS = threading.BoundedSemaphore(MAX_PENDING)
+
+# Максимум видео в одном пакетном запросе /subtitles?ids=...:
+# один пакет не занимает больше слотов, чем потоков в пуле
+MAX_BATCH_SIZE = MAX_WORKERS
+
+# Клиент YouTubeTranscriptApi на поток пула: его HTTP-сессия держит
+# соединения с YouTube открытыми (keep-alive) между запросами. Клиент
+# не потокобезопасен, поэтому свой в каждом потоке
+_THREAD_LOCAL = threading.local()
+
+# Таймаут (подключение, чтение) для каждого HTTP-запроса к YouTube:
+# сама библиотека его не задает, и зависшее соединение навсегда заняло бы поток пула
+HTTP_TIMEOUT = (5, 15)
+# Сколько route ждет результат из пула (включая время в очереди);
+# для пакетного запроса - общий срок на все видео
+SUBTITLES_TIMEOUT = 120
+
+# Запросы, которые уже выполняются: одновременные обращения
+# к одному video_id ждут общий future вместо повторного запроса
+_INFLIGHT = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+# Начиная с этого числа фрагментов ответ отдается потоком,
+# чтобы не собирать весь JSON в памяти
+STREAM_THRESHOLD = 2000
+# Сколько фрагментов сериализуется за один yield
+STREAM_CHUNK_SIZE = 500
+
+class TimeoutSession(Session):
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', HTTP_TIMEOUT)
+        return super().request(*args, **kwargs)
+
+def get_transcript_api():
+    ytt_api = getattr(_THREAD_LOCAL, 'ytt_api', None)
+    if ytt_api is None:
+        ytt_api = YouTubeTranscriptApi(http_client=TimeoutSession())
+        _THREAD_LOCAL.ytt_api = ytt_api
+    return ytt_api
+
+def get_cached_result(video_id):
+    with _CACHE_LOCK:
+        return _RESULT_CACHE.get(video_id)
+
+def drop_cached_result(video_id):
+    with _CACHE_LOCK:
+        _RESULT_CACHE.pop(video_id, None)
 
 def get_subtitles_logic(video_id):
+    # Повторная проверка: результат мог появиться, пока задача ждала в очереди
+    cached = get_cached_result(video_id)
+    if cached is not None:
+        return cached, 200
+
     try:
-        # Создаем экземпляр API
-        ytt_api = YouTubeTranscriptApi()
-        
         # Получаем список доступных субтитров
-        transcript_list = ytt_api.list(video_id)
-        print(transcript_list)
+        transcript_list = get_transcript_api().list(video_id)
+        logger.debug("Доступные субтитры для %s:\n%s", video_id, transcript_list)
         
-        # Сначала пытаемся найти русские субтитры
-        try:
-            transcript = transcript_list.find_transcript(['ru'])
-        except NoTranscriptFound:
-            # Если русских нет, ищем английские
-            transcript = transcript_list.find_transcript(['en'])
+        # Ищем русские субтитры, если их нет - английские
+        transcript = transcript_list.find_transcript(SUBTITLE_LANGUAGES)
         
         # Получаем данные субтитров
         subtitles_data = transcript.fetch()
         
-        return {
+        result = {
             'status': 'success',
             'video_id': video_id,
             'data': subtitles_data
         }
-    except TranscriptsDisabled:
-        return {'status': 'error', 'message': 'Субтитры отключены для этого видео.'}
-    except NoTranscriptFound:
-        return {'status': 'error', 'message': 'Субтитры на указанных языках (ru, en) не найдены.'}
-    except VideoUnavailable:
-        return {'status': 'error', 'message': 'Видео недоступно (удалено или приватное).'}
+        with _CACHE_LOCK:
+            _RESULT_CACHE[video_id] = result
+        return result, 200
+    except tuple(_ERRORS) as e:
+        # isinstance, а не type(e): подклассы этих ошибок тоже находятся
+        message, status_code = next(v for t, v in _ERRORS.items() if isinstance(e, t))
+        return {'status': 'error', 'message': message}, status_code
     except Exception as e:
-        return {'status': 'error', 'message': f'Непредвиденная ошибка: {str(e)}'}
+        logger.exception("Непредвиденная ошибка для %s", video_id)
+        return {'status': 'error', 'message': f'Непредвиденная ошибка: {str(e)}'}, 400
+
+def submit_subtitles(video_id):
+    with _INFLIGHT_LOCK:
+        future = _INFLIGHT.get(video_id)
+        if future is not None:
+            return future
+        # Пул заполнен - не ставим задачу в очередь (вызывающий вернет 503)
+        if not _PENDING_SLOTS.acquire(blocking=False):
+            return None
+        future = EXECUTOR.submit(get_subtitles_logic, video_id)
+        _INFLIGHT[video_id] = future
+
+    def forget(done):
+        with _INFLIGHT_LOCK:
+            if _INFLIGHT.get(video_id) is done:
+                del _INFLIGHT[video_id]
+        # Слот освобождается, когда задача действительно завершилась,
+        # даже если клиент перестал ее ждать по таймауту
+        _PENDING_SLOTS.release()
+
+    # Колбэк вешается вне блокировки: для уже завершенного
+    # future он вызывается сразу в текущем потоке
+    future.add_done_callback(forget)
+    return future
+
+def wait_subtitles(video_id, future, timeout):
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        # Сама задача продолжает выполняться и по завершении попадет в кэш
+        logger.warning("Не дождались субтитров для %s за %.1f с", video_id, timeout)
+        return TIMEOUT_RESULT, 504
+
+def stream_subtitles(result):
+    transcript = result['data']
+    meta = {
+        'video_id': transcript.video_id,
+        'language': transcript.language,
+        'language_code': transcript.language_code,
+        'is_generated': transcript.is_generated,
+    }
+
+    def generate():
+        # Метаданные, затем массив фрагментов по частям
+        yield (
+            b'{"status":"success","video_id":' + orjson.dumps(result['video_id'])
+            + b',"data":' + orjson.dumps(meta)[:-1] + b',"snippets":['
+        )
+        snippets = transcript.snippets
+        for start in range(0, len(snippets), STREAM_CHUNK_SIZE):
+            # orjson сериализует dataclass фрагмента напрямую, без asdict()
+            chunk = orjson.dumps(snippets[start:start + STREAM_CHUNK_SIZE])[1:-1]
+            yield (b',' if start else b'') + chunk
+        yield b']}}'
+
+    return Response(generate(), mimetype='application/json')
+
+# Ответ главной страницы не меняется - сериализуем его один раз
+_INDEX_BODY = orjson.dumps({
+    'message': 'YouTube Subtitles API is running',
+    'usage': '/subtitles/<video_id>[?refresh=1]',
+    'batch_usage': '/subtitles?ids=<video_id>,<video_id>,...'
+})
 
 @app.route('/')
 def index():
-    return jsonify({
-        'message': 'YouTube Subtitles API is running',
-        'usage': '/subtitles/<video_id>'
-    })
+    return Response(_INDEX_BODY, mimetype='application/json')
 
 @app.route('/subtitles/<video_id>')
 def subtitles(video_id):
-    result = get_subtitles_logic(video_id)
-    
-    if result['status'] == 'success':
-        return jsonify(result)
+    # Заведомо неверный идентификатор отклоняем без запроса к YouTube
+    if not _VIDEO_ID_RE.fullmatch(video_id):
+        return jsonify(INVALID_ID_RESULT), 400
+
+    # ?refresh=1 - принудительно перезапрашиваем субтитры у YouTube
+    if request.args.get('refresh') == '1':
+        drop_cached_result(video_id)
+
+    # Попадание в кэш отдаем сразу, минуя пул потоков
+    cached = get_cached_result(video_id)
+    if cached is not None:
+        result, status_code = cached, 200
     else:
-        # Возвращаем ошибку с соответствующим кодом
-        status_code = 404 if "не найдены" in result['message'] else 400
-        return jsonify(result), status_code
+        future = submit_subtitles(video_id)
+        if future is None:
+            return jsonify(BUSY_RESULT), 503
+        result, status_code = wait_subtitles(video_id, future, SUBTITLES_TIMEOUT)
+    
+    if result['status'] == 'success' and len(result['data']) > STREAM_THRESHOLD:
+        return stream_subtitles(result)
+    return jsonify(result), status_code
+
+@app.route('/subtitles')
+def subtitles_batch():
+    # Дубликаты убираем, порядок сохраняем
+    video_ids = list(dict.fromkeys(filter(None, request.args.get('ids', '').split(','))))
+    if not video_ids:
+        return jsonify({'status': 'error', 'message': 'Не переданы идентификаторы видео (параметр ids).'}), 400
+    if len(video_ids) > MAX_BATCH_SIZE:
+        return jsonify({'status': 'error', 'message': f'Не больше {MAX_BATCH_SIZE} видео за один запрос.'}), 400
+
+    # Сначала ставим все видео в пул, потом ждем: запросы к YouTube идут параллельно
+    pending = {}
+    for video_id in video_ids:
+        if not _VIDEO_ID_RE.fullmatch(video_id):
+            pending[video_id] = INVALID_ID_RESULT
+        else:
+            pending[video_id] = get_cached_result(video_id) or submit_subtitles(video_id) or BUSY_RESULT
+
+    deadline = time.monotonic() + SUBTITLES_TIMEOUT
+    results = {}
+    for video_id, item in pending.items():
+        if isinstance(item, Future):
+            item = wait_subtitles(video_id, item, max(0, deadline - time.monotonic()))[0]
+        results[video_id] = item
+
+    return jsonify({'status': 'success', 'results': results})
 
 if __name__ == '__main__':
     # Порт для Render
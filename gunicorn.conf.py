@@ -0,0 +1,23 @@
+# Конфигурация gunicorn: подхватывается автоматически при запуске
+# `gunicorn app:app` из корня проекта
+import os
+
+# Порт для Render
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+
+# Запросы к YouTube в основном ждут сеть, поэтому потоки в каждом воркере.
+# GUNICORN_WORKER_CLASS=gevent переключает на гринлеты (нужен пакет gevent,
+# monkey-patching gunicorn делает сам)
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = 8
+worker_connections = 1000
+timeout = 60
+
+# app.py импортируется один раз в мастере до fork: скомпилированные
+# регулярки, orjson-провайдер и пр. делятся между воркерами (copy-on-write).
+# Пул потоков и клиенты YouTube создаются лениво, уже в воркере.
+# Для gevent/eventlet (любое написание класса: gevent_wsgi, eventlet,
+# gunicorn.workers.ggevent.GeventWorker...) не включаем: патчинг должен
+# произойти до импорта приложения
+preload_app = not any(name in worker_class.lower() for name in ('gevent', 'eventlet'))